@@ -1,28 +1,71 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
 import numpy as np
+import orjson
 import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from qiskit import QuantumCircuit
-from qiskit.quantum_info import Statevector
+from qiskit.exceptions import QiskitError
+from qiskit.quantum_info import Operator, Statevector
 import math
 
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson, which also encodes NumPy arrays natively."""
+    options = orjson.OPT_SERIALIZE_NUMPY
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.options).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response without a str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.options), mimetype='application/json')
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Longest user code accepted by /execute, in characters
+MAX_CODE_LENGTH = 32 * 1024
+CODE_TOO_LARGE = f"Code too large. Maximum supported: {MAX_CODE_LENGTH // 1024}KB"
+
+# Werkzeug refuses larger request bodies with a 413 before reading them. JSON
+# escaping (\n, \", ...) makes the body longer than the code it carries, so leave
+# headroom and let validate_code enforce the exact per-field limit
+app.config['MAX_CONTENT_LENGTH'] = 2 * MAX_CODE_LENGTH
+
+# Most qubits the page can visualize
+MAX_QUBITS = 9
+
+# Single precision is plenty for drawing Bloch vectors and halves the memory traffic
+STATE_DTYPE = np.complex64
+
+# Patterns used to guess the qubit count from user code
+_CIRCUIT_RE = re.compile(r'QuantumCircuit\s*\(\s*(\d+)')
+_INDEX_RE = re.compile(r'\[\s*(\d+)\s*\]')
 
 def parse_qubit_count(code):
     """Parse the quantum code to determine the number of qubits needed."""
     try:
         # Method 1: Look for QuantumCircuit(n) initialization
-        circuit_match = re.search(r'QuantumCircuit\s*\(\s*(\d+)', code)
+        circuit_match = _CIRCUIT_RE.search(code)
         if circuit_match:
             return int(circuit_match.group(1))
         
         # Method 2: Find the highest qubit index used
-        qubit_indices = re.findall(r'\[\s*(\d+)\s*\]', code)
-        if qubit_indices:
-            return max(int(idx) for idx in qubit_indices) + 1
+        highest_index = -1
+        for index_match in _INDEX_RE.finditer(code):
+            highest_index = max(highest_index, int(index_match.group(1)))
+        if highest_index >= 0:
+            return highest_index + 1
         
         # Default to 1 qubit if nothing found
         return 1
-    except:
+    except ValueError:
         return 1
 
 def calculate_grid_dimensions(num_qubits):
@@ -44,137 +87,411 @@ def calculate_grid_dimensions(num_qubits):
         cols = math.ceil(num_qubits / rows)
         return rows, cols
 
-def statevector_to_bloch_coords(statevector, qubit_index, num_qubits):
-    """Convert statevector to Bloch sphere coordinates for a specific qubit."""
-    try:
-        from qiskit.quantum_info import partial_trace, DensityMatrix
-        
-        # Convert to density matrix
-        rho = DensityMatrix(statevector)
-        
-        # Get reduced density matrix for the specific qubit
-        # Trace out all other qubits
-        other_qubits = [i for i in range(num_qubits) if i != qubit_index]
+@lru_cache(maxsize=256)
+def gate_local_indices(qubits, num_qubits):
+    """Return, for every amplitude, the row of a gate matrix on `qubits` it belongs to."""
+    # Gate matrices are little-endian in their qubit arguments, so qubits[0]
+    # supplies the lowest bit of the row index
+    index = np.arange(2 ** num_qubits)
+    local = np.zeros_like(index)
+    for position, qubit in enumerate(qubits):
+        local |= ((index >> qubit) & 1) << position
+    
+    local.setflags(write=False)
+    return local
+
+@lru_cache(maxsize=256)
+def gate_gather_indices(sources, qubits, num_qubits):
+    """Return the flat indices a permutation gate on `qubits` reads each amplitude from."""
+    source_local = np.asarray(sources)[gate_local_indices(qubits, num_qubits)]
+    
+    # Keep the non-target bits and take the target bits from the source row
+    target_mask = sum(1 << qubit for qubit in qubits)
+    gather = np.arange(2 ** num_qubits) & ~target_mask
+    for position, qubit in enumerate(qubits):
+        gather |= ((source_local >> position) & 1) << qubit
+    
+    gather.setflags(write=False)
+    return gather
+
+def monomial_gate_structure(matrix):
+    """Split a gate with one nonzero per row into (sources, phases), or return None."""
+    # Row i of such a gate reads amplitude sources[i] and scales it by phases[i];
+    # either part is None when it is trivial (identity permutation / all ones)
+    size = len(matrix)
+    nonzero = matrix != 0
+    if np.count_nonzero(nonzero) != size:
+        return None
+    
+    rows = np.arange(size)
+    sources = nonzero.argmax(axis=1)
+    phases = matrix[rows, sources]
+    
+    sources = None if (sources == rows).all() else tuple(sources.tolist())
+    if (phases == 1).all():
+        phases = None
+    else:
+        phases.setflags(write=False)
+    return sources, phases
+
+@lru_cache(maxsize=1024)
+def small_gate_structure(matrix_bytes, num_gate_qubits):
+    """Memoized monomial_gate_structure for a gate matrix on at most two qubits."""
+    size = 2 ** num_gate_qubits
+    return monomial_gate_structure(np.frombuffer(matrix_bytes, dtype=STATE_DTYPE).reshape(size, size))
+
+def apply_gate(psi, matrix, qubits, num_qubits):
+    """Apply a gate matrix to the flat statevector on the given qubits."""
+    k = len(qubits)
+    
+    # A unitary with exactly one nonzero per row (X, Y, Z, S, T, RZ, CX, CZ,
+    # SWAP, CCX, ...) only moves amplitudes around and/or rephases them, so
+    # it reduces to a gather plus an elementwise multiply. Classifying costs
+    # more than applying a 1-2 qubit gate, so those are memoized on their
+    # (at most 128-byte) matrix; larger matrices are classified every time
+    if k <= 2:
+        structure = small_gate_structure(matrix.astype(STATE_DTYPE, copy=False).tobytes(), k)
+    else:
+        structure = monomial_gate_structure(matrix)
+    
+    if structure is not None:
+        sources, phases = structure
+        qubits = tuple(qubits)
+        if sources is not None:
+            psi = psi[gate_gather_indices(sources, qubits, num_qubits)]
+        if phases is not None:
+            psi = psi * phases[gate_local_indices(qubits, num_qubits)]
+        return psi
+    
+    if k == 1:
+        # Split each index into (higher bits, target bit, lower bits) so every
+        # |..0_t..⟩, |..1_t..⟩ amplitude pair sits along the middle axis
+        target = qubits[0]
+        pairs = psi.reshape(2 ** (num_qubits - 1 - target), 2, 2 ** target)
+        return np.matmul(matrix, pairs).ravel()
+    
+    # Qiskit is little-endian: qubit q is axis (n - 1 - q) of the (2,)*n tensor.
+    # Gate matrices are little-endian too, so the first tensor axes of the
+    # reshaped matrix belong to the last qubit argument
+    axes = [num_qubits - 1 - q for q in reversed(qubits)]
+    u = np.asarray(matrix).reshape((2,) * (2 * k))
+    
+    # Contract the gate's input axes with the target axes, then put the
+    # output axes back where the targets were
+    psi = np.tensordot(u, psi.reshape((2,) * num_qubits), axes=(list(range(k, 2 * k)), axes))
+    return np.moveaxis(psi, list(range(k)), axes).ravel()
+
+@lru_cache(maxsize=MAX_QUBITS)
+def qubit_pair_indices(num_qubits):
+    """Return flat amplitude indices pairing |..0_k..⟩ with |..1_k..⟩ for every qubit k."""
+    # Qiskit is little-endian: qubit k is bit k of the flat amplitude index
+    index = np.arange(2 ** num_qubits)
+    bits = 1 << np.arange(num_qubits)
+    
+    zero = np.array([index[(index & bit) == 0] for bit in bits], dtype=np.intp)
+    zero = zero.reshape(num_qubits, 2 ** num_qubits // 2)
+    one = zero | bits[:, None]
+    
+    # Shared between calls, so keep them read-only
+    zero.setflags(write=False)
+    one.setflags(write=False)
+    return zero, one
+
+@lru_cache(maxsize=MAX_QUBITS)
+def qubit_z_signs(num_qubits):
+    """Return an (n, 2^n) table whose row k is +1/-1 where qubit k is |0⟩/|1⟩."""
+    index = np.arange(2 ** num_qubits)
+    bits = (index >> np.arange(num_qubits)[:, None]) & 1
+    
+    signs = (1 - 2 * bits).astype(np.float32)
+    signs.setflags(write=False)
+    return signs
+
+def all_bloch_coords(statevector, num_qubits, qubits=None):
+    """Compute Bloch sphere coordinates for every qubit (or just `qubits`) from the statevector."""
+    psi = np.asarray(statevector).ravel()
+    
+    # A single qubit is just two amplitudes, so skip the gather entirely
+    if num_qubits == 1:
+        alpha, beta = psi
+        rho_01 = alpha * beta.conjugate()
+        return np.array([[2 * rho_01.real, -2 * rho_01.imag, abs(alpha) ** 2 - abs(beta) ** 2]])
+    
+    zero, one = qubit_pair_indices(num_qubits)
+    signs = qubit_z_signs(num_qubits)
+    if qubits is not None:
+        zero, one, signs = zero[qubits], one[qubits], signs[qubits]
+    
+    # Reduced density matrix elements without building the full ρ.
+    # Row k of psi[zero] / psi[one] holds the amplitudes with qubit k in
+    # |0⟩ / |1⟩, so ρ_01 = Σ ψ0·ψ1* for all qubits in one reduction
+    rho_01 = (psi[zero] * psi[one].conj()).sum(axis=1)
+    
+    # ρ_00 - ρ_11 for every qubit from a single pass over |ψ|²
+    probs = psi.real ** 2 + psi.imag ** 2
+    
+    # ⟨σ_x⟩ = 2 * Re(ρ_01), ⟨σ_y⟩ = -2 * Im(ρ_01), ⟨σ_z⟩ = ρ_00 - ρ_11
+    coords = np.empty((len(rho_01), 3), dtype=np.float32)
+    coords[:, 0] = 2 * rho_01.real
+    coords[:, 1] = -2 * rho_01.imag
+    coords[:, 2] = signs @ probs
+    return coords
+
+def evolve_instruction(psi, operation, qubits):
+    """Apply a non-unitary instruction (reset, initialize, ...) to the flat statevector."""
+    # Qiskit samples reset outcomes from the probabilities, which must sum to 1
+    # in double precision, so renormalize after leaving single precision
+    psi = psi.astype(complex)
+    psi /= np.linalg.norm(psi)
+    return Statevector(psi).evolve(operation, qargs=qubits).data.astype(STATE_DTYPE)
+
+def circuit_steps(circuit):
+    """List the circuit's instructions as (gate_name, qubits, matrix) steps."""
+    # Map qubit objects to their indices once instead of calling find_bit per gate
+    qubit_index = {qubit: index for index, qubit in enumerate(circuit.qubits)}
+    
+    steps = []
+    for instruction in circuit.data:
+        gate = instruction[0]
+        qubits = [qubit_index[qubit] for qubit in instruction[1]]
         
-        if other_qubits:
-            rho_reduced = partial_trace(rho, other_qubits)
+        # Barriers still get a frame but leave the state unchanged
+        if gate.name == 'barrier':
+            matrix = None
         else:
-            rho_reduced = rho
-        
-        # Extract density matrix elements
-        rho_matrix = rho_reduced.data
-        
-        # Calculate Bloch vector components using Pauli expectation values
-        # ⟨σ_x⟩ = Tr(ρ σ_x) = 2 * Re(ρ_01)
-        # ⟨σ_y⟩ = Tr(ρ σ_y) = 2 * Im(ρ_01)  
-        # ⟨σ_z⟩ = Tr(ρ σ_z) = ρ_00 - ρ_11
-        
-        x = 2 * np.real(rho_matrix[0, 1])
-        y = -2 * np.imag(rho_matrix[0, 1])  # Note the minus sign
-        z = np.real(rho_matrix[0, 0] - rho_matrix[1, 1])
-        
-        return [float(x), float(y), float(z)]
-        
-    except Exception as e:
-        print(f"Error calculating Bloch coordinates: {e}")
-        return [0, 0, 1]  # Default to |0⟩ state
+            try:
+                matrix = Operator(gate).data.astype(STATE_DTYPE)
+            except QiskitError:
+                # No matrix for non-unitary instructions such as reset and
+                # initialize; keep the instruction itself for Qiskit to evolve
+                matrix = gate
+        steps.append((gate.name, qubits, matrix))
+    
+    return steps
+
+def fuse_single_qubit_gates(steps):
+    """Merge runs of consecutive single-qubit gates on the same qubit into one step."""
+    fused = []
+    for gate_name, qubits, matrix in steps:
+        if fused and len(qubits) == 1 and isinstance(matrix, np.ndarray):
+            prev_name, prev_qubits, prev_matrix = fused[-1]
+            if prev_qubits == qubits and isinstance(prev_matrix, np.ndarray):
+                # The later gate acts after the pending ones, so it multiplies from the left
+                fused[-1] = (f'{gate_name}·{prev_name}', qubits, matrix @ prev_matrix)
+                continue
+        fused.append((gate_name, qubits, matrix))
+    
+    return fused
 
-def get_animation_sequence(circuit, num_qubits):
-    """Break circuit into steps and return sequence of Bloch coordinates."""
+def animation_frames(circuit, num_qubits, fuse_gates=False):
+    """Yield (gate_name, target_qubits, bloch_coords) for each step as it is simulated."""
+    steps = circuit_steps(circuit)
+    if fuse_gates:
+        steps = fuse_single_qubit_gates(steps)
+    
     # Start with |0...0⟩ state
-    current_state = Statevector.from_label('0' * num_qubits)
+    current_state = np.zeros(2 ** num_qubits, dtype=STATE_DTYPE)
+    current_state[0] = 1
     
     # Initial state (all qubits at |0⟩)
-    sequence = []
-    initial_coords = []
-    for qubit_idx in range(num_qubits):
-        coords = statevector_to_bloch_coords(current_state, qubit_idx, num_qubits)
-        initial_coords.append({
-            'qubit_index': qubit_idx,
-            'coordinates': coords,
-            'label': f'Qubit {qubit_idx}'
-        })
-    
-    sequence.append({
-        'step': 0,
-        'gate_name': 'Initial State',
-        'bloch_data': initial_coords
-    })
+    coords = np.empty((num_qubits, 3), dtype=np.float32)
+    coords[:] = all_bloch_coords(current_state, num_qubits)
+    yield 'Initial State', None, coords
     
-    # Apply each gate and capture intermediate states
-    step_circuit = QuantumCircuit(num_qubits)
-    
-    for step, instruction in enumerate(circuit.data):
-        gate = instruction[0]
-        qubits = [circuit.find_bit(qubit).index for qubit in instruction[1]]        
-        # Add this gate to our step circuit
-        step_circuit.append(gate, qubits)
-        
-        # Get new state after this gate
-        current_state = Statevector.from_instruction(step_circuit)
-        
-        # Calculate new Bloch coordinates
-        step_coords = []
-        for qubit_idx in range(num_qubits):
-            coords = statevector_to_bloch_coords(current_state, qubit_idx, num_qubits)
-            step_coords.append({
-                'qubit_index': qubit_idx,
-                'coordinates': coords,
-                'label': f'Qubit {qubit_idx}'
-            })
+    # Apply each gate to the running state and capture intermediate states
+    for gate_name, qubits, matrix in steps:
+        coords = coords.copy()
         
-        sequence.append({
-            'step': step + 1,
-            'gate_name': gate.name,
-            'target_qubits': qubits,
-            'bloch_data': step_coords
-        })
-    
-    return sequence
+        # Evolve the previous state by this gate only
+        if isinstance(matrix, np.ndarray):
+            current_state = apply_gate(current_state, matrix, qubits, num_qubits)
+            
+            # A gate cannot change the reduced state of qubits it does not act on,
+            # even entangled ones, so only the targets need new Bloch coordinates
+            coords[qubits] = all_bloch_coords(current_state, num_qubits, qubits)
+        elif matrix is not None:
+            current_state = evolve_instruction(current_state, matrix, qubits)
+            
+            # Resets collapse the state, which can move qubits entangled with
+            # the targets too, so recompute every qubit
+            coords[:] = all_bloch_coords(current_state, num_qubits)
+        yield gate_name, qubits, coords
 
-def execute_quantum_code(code):
-    """Execute quantum code and return animation sequence."""
+# Names available to user code
+EXEC_NAMESPACE = {
+    'QuantumCircuit': QuantumCircuit,
+    'np': np,
+    'math': math,
+    'pi': np.pi
+}
+
+# Identical code always yields the same animation, so re-runs are replayed from here.
+# Memory grows with frames (about 600 bytes each at 9 qubits), not entries, so the
+# cache is bounded by total frames and runs longer than RESULT_CACHE_MAX_FRAMES
+# are streamed without being kept
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_MAX_FRAMES = 2000
+RESULT_CACHE_TOTAL_FRAMES = 50000
+result_cache = OrderedDict()
+result_cache_frames = 0
+result_cache_lock = threading.Lock()
+
+def too_many_qubits(num_qubits):
+    """Return the error message for a circuit wider than MAX_QUBITS."""
+    return f"Too many qubits for visualization. Maximum supported: {MAX_QUBITS}, requested: {num_qubits}"
+
+def load_circuit(code):
+    """Execute quantum code and return the circuit it defines."""
     try:
         # Parse number of qubits needed
         num_qubits = parse_qubit_count(code)
         
         # Cap the number of qubits for visualization
-        MAX_QUBITS = 9
         if num_qubits > MAX_QUBITS:
-            return None, num_qubits, f"Too many qubits for visualization. Maximum supported: {MAX_QUBITS}, requested: {num_qubits}"
+            return None, num_qubits, too_many_qubits(num_qubits)
         
-        # Create a namespace for execution
-        namespace = {
-            'QuantumCircuit': QuantumCircuit,
-            'np': np,
-            'math': math,
-            'pi': np.pi
-        }
+        # Create a fresh namespace for execution
+        namespace = dict(EXEC_NAMESPACE)
         
         # Execute the code
         exec(code, namespace)
         
         # Try to find the quantum circuit in the namespace
-        qc = None
-        for var_name, var_value in namespace.items():
-            if isinstance(var_value, QuantumCircuit):
-                qc = var_value
-                break
+        qc = next((value for value in namespace.values() if isinstance(value, QuantumCircuit)), None)
         
         if qc is None:
             return None, num_qubits, "No quantum circuit found in code"
         
-        # Update num_qubits based on actual circuit if found
-        num_qubits = qc.num_qubits
-        
-        # Get animation sequence by applying gates step by step
-        animation_sequence = get_animation_sequence(qc, num_qubits)
+        # The regex only guesses, e.g. QuantumCircuit(n) with n from a variable
+        # slips past it, so check the circuit that was actually built
+        if qc.num_qubits > MAX_QUBITS:
+            return None, qc.num_qubits, too_many_qubits(qc.num_qubits)
         
-        return animation_sequence, num_qubits, None
+        # Update num_qubits based on actual circuit if found
+        return qc, qc.num_qubits, None
         
     except Exception as e:
         return None, 1, str(e)
 
+def simulate_events(code, fuse_gates=False):
+    """Yield ('meta' | 'frame' | 'error', payload) events while running the code."""
+    qc, num_qubits, error = load_circuit(code)
+    if error:
+        yield 'error', {'error': error}
+        return
+    
+    yield 'meta', animation_metadata(num_qubits)
+    
+    # Emit each frame as soon as it is simulated instead of the whole sequence at the end
+    try:
+        for step, (gate_name, qubits, coords) in enumerate(animation_frames(qc, num_qubits, fuse_gates)):
+            # Frames may be replayed from the cache, so keep them read-only
+            coords.setflags(write=False)
+            yield 'frame', {
+                'step': step,
+                'gate_name': gate_name,
+                'target_qubits': qubits,
+                'coords': coords
+            }
+    except Exception as e:
+        yield 'error', {'error': str(e)}
+
+def animation_events(code, fuse_gates=False):
+    """Yield the events for the code, replaying them from the result cache on re-runs."""
+    key = (code, fuse_gates)
+    with result_cache_lock:
+        events = result_cache.get(key)
+        if events is not None:
+            result_cache.move_to_end(key)
+    
+    if events is not None:
+        yield from events
+        return
+    
+    events = []
+    for event in simulate_events(code, fuse_gates):
+        if events is not None:
+            events.append(event)
+            if len(events) > RESULT_CACHE_MAX_FRAMES:
+                # Too long to keep; stream the rest without recording it
+                events = None
+        yield event
+    
+    if events is None:
+        return
+    
+    # Only reached when the run was consumed to the end, so partial runs
+    # (e.g. a client disconnecting mid-stream) are never cached
+    global result_cache_frames
+    with result_cache_lock:
+        previous = result_cache.pop(key, None)
+        if previous is not None:
+            result_cache_frames -= len(previous)
+        result_cache[key] = events
+        result_cache_frames += len(events)
+        while len(result_cache) > RESULT_CACHE_SIZE or result_cache_frames > RESULT_CACHE_TOTAL_FRAMES:
+            _, evicted = result_cache.popitem(last=False)
+            result_cache_frames -= len(evicted)
+
+def execute_quantum_code(code, fuse_gates=False):
+    """Execute quantum code and return animation sequence."""
+    num_qubits, frames, error = 1, [], None
+    
+    # Consume every event, even after an error, so the run gets cached
+    for event, payload in animation_events(code, fuse_gates):
+        if event == 'meta':
+            num_qubits = payload['num_qubits']
+        elif event == 'frame':
+            frames.append(payload)
+        else:
+            error = payload['error']
+    
+    if error:
+        return None, num_qubits, error
+    
+    # One (steps, qubits, xyz) array for the whole animation
+    animation_sequence = {
+        'coords': np.stack([frame['coords'] for frame in frames]),
+        'gate_names': [frame['gate_name'] for frame in frames],
+        'target_qubits': [frame['target_qubits'] for frame in frames]
+    }
+    return animation_sequence, num_qubits, None
+
+def validate_code(code):
+    """Return an (error message, status) pair if the code should not be run, else None."""
+    # Reject huge submissions before spending any copy, regex or compile time on them
+    if len(code) > MAX_CODE_LENGTH:
+        return CODE_TOO_LARGE, 413
+    
+    if not code.strip():
+        return 'No code provided', 200
+    
+    return None
+
+def animation_metadata(num_qubits):
+    """Describe the qubit grid the frontend should lay out."""
+    rows, cols = calculate_grid_dimensions(num_qubits)
+    return {
+        'num_qubits': num_qubits,
+        'qubit_labels': [f'Qubit {i}' for i in range(num_qubits)],
+        'grid_rows': rows,
+        'grid_cols': cols
+    }
+
+def error_response(message, status=200):
+    """Build the JSON response for a failed /execute request."""
+    response = jsonify({
+        'success': False,
+        'error': message,
+        'animation_sequence': None
+    })
+    response.status_code = status
+    return response
+
+def sse_event(event, data):
+    """Encode one Server-Sent Events message with a JSON payload."""
+    return b'event: ' + event.encode() + b'\ndata: ' + orjson.dumps(data, option=OrjsonProvider.options) + b'\n\n'
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -182,35 +499,45 @@ def index():
 @app.route('/execute', methods=['POST'])
 def execute():
     code = request.json.get('code', '')
+    fuse_gates = bool(request.json.get('fuse_gates', False))
     
-    if not code.strip():
-        return jsonify({
-            'success': False,
-            'error': 'No code provided',
-            'animation_sequence': None
-        })
+    invalid = validate_code(code)
+    if invalid:
+        return error_response(*invalid)
     
     # Execute the quantum code
-    animation_sequence, num_qubits, error = execute_quantum_code(code)
+    animation_sequence, num_qubits, error = execute_quantum_code(code, fuse_gates)
     
     if error:
-        return jsonify({
-            'success': False,
-            'error': error,
-            'animation_sequence': None
-        })
-    
-    # Calculate grid dimensions
-    rows, cols = calculate_grid_dimensions(num_qubits)
+        return error_response(error)
     
     return jsonify({
         'success': True,
         'error': None,
         'animation_sequence': animation_sequence,
-        'num_qubits': num_qubits,
-        'grid_rows': rows,
-        'grid_cols': cols
+        **animation_metadata(num_qubits)
     })
 
+@app.route('/execute/stream', methods=['POST'])
+def execute_stream():
+    code = request.json.get('code', '')
+    fuse_gates = bool(request.json.get('fuse_gates', False))
+    
+    def generate():
+        invalid = validate_code(code)
+        if invalid:
+            yield sse_event('error', {'error': invalid[0]})
+            return
+        
+        for event, payload in animation_events(code, fuse_gates):
+            yield sse_event(event, payload)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
+@app.errorhandler(413)
+def request_too_large(error):
+    # Raised by Werkzeug for bodies over MAX_CONTENT_LENGTH, before any JSON is parsed
+    return error_response(CODE_TOO_LARGE, 413)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file